@@ -33,6 +33,7 @@ function App() {
   const [file, setFile] = useState(null);
   const [maskFile, setMaskFile] = useState(null);
   const [frames, setFrames] = useState([]);
+  const [frameMime, setFrameMime] = useState('image/jpeg');
   const [currentFrame, setCurrentFrame] = useState(0);
   const [analyzing, setAnalyzing] = useState(false);
   const [results, setResults] = useState(null);
@@ -279,6 +280,7 @@ function App() {
       const response = await api.post('/upload', formData);
       setUploadedVideoPath(response.data.path);
       setFrames(response.data.frames);
+      setFrameMime(response.data.frame_mime || 'image/jpeg');
       setTotalFrames(response.data.frames.length);
       setCurrentFrame(0);
     } catch (error) {
@@ -325,7 +327,7 @@ function App() {
       });
       
       setResults(response.data);
-      setMaskPreview(response.data.mask_preview);
+      setMaskPreview(`${API_URL}${response.data.mask_preview_url}`);
       
       // Load CSV data
       if (response.data.results_path) {
@@ -1049,7 +1051,7 @@ function App() {
             <div className="flex flex-wrap md:flex-nowrap gap-4">
               <div className="w-full md:w-1/2">
                 <Typography variant="h6" gutterBottom>Video</Typography>
-                <VideoDisplay currentFrame={`data:image/png;base64,${frames[currentFrame]}`} frameCount={currentFrame} brightness={brightness} />
+                <VideoDisplay currentFrame={`data:${frameMime};base64,${frames[currentFrame]}`} frameCount={currentFrame} brightness={brightness} />
                 <div className="flex items-center justify-center space-x-4 mb-4 mt-2">
                   <button onClick={previousFrame} className="p-2 rounded-full hover:bg-gray-200">
                     <SkipBack className="w-6 h-6" />
@@ -1,20 +1,35 @@
+import orjson
 from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask.json.provider import JSONProvider
+from flask_caching import Cache
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
+import shutil
 import numpy as np
 import cv2
 import tifffile
 import pandas as pd
 import base64
-import colorsys
+import functools
+import hashlib
+import json
 import logging
+import numexpr as ne
+import plotnine as p9
+import pyarrow as pa
+import pyarrow.parquet as pq
 import rpy2.robjects as ro
+import rpy2_arrow.arrow as pyra
 from rpy2.robjects import pandas2ri
 from rpy2.robjects.packages import importr
 from rpy2.robjects import conversion, default_converter
 from rpy2.robjects.conversion import localconverter
+import torch
+from numba import njit, prange
+from scipy import ndimage
 from cellpose import models
+from concurrent.futures import ThreadPoolExecutor
 import io
 import sys
 import time
@@ -33,17 +48,57 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 fh.setFormatter(formatter)
 logger.addHandler(fh)
 
+# Plot backend: plotnine renders in-process; set PLOT_BACKEND=ggplot2 to
+# keep the R pipeline for output parity checks
+PLOT_BACKEND = os.environ.get('PLOT_BACKEND', 'plotnine')
+
+# Allow TF32 tensor cores for the Cellpose convolution/matmul pass
+torch.set_float32_matmul_precision('high')
+
+# Initialize libjpeg-turbo for fast preview frame encoding
+try:
+    from turbojpeg import TurboJPEG
+    turbo_jpeg = TurboJPEG()
+except Exception as e:
+    logger.warning(f"TurboJPEG unavailable, falling back to OpenCV JPEG: {e}")
+    turbo_jpeg = None
+
 # Initialize R packages
 with localconverter(default_converter + pandas2ri.converter) as cv:
     base = importr('base')
     ggplot2 = importr('ggplot2')
     dplyr = importr('dplyr')
     grdevices = importr('grDevices')
+    ragg = importr('ragg')
+    # Enable the R JIT and load the plotting function once; per-request
+    # calls then skip R lexing/parsing entirely
+    ro.r('compiler::enableJIT(3)')
+    ro.r['source'](os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'plot_calcium.R'))
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson; handles numpy scalars natively."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
+# Uploads are streamed to disk, so only a hard cap on request size is needed
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 * 1024
+
+# Behind nginx, let X-Sendfile hand file transfers to the proxy entirely
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true')
+
+# In-process cache for rendered plots and parsed results
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 3600})
+
 # Configure upload paths
 current_dir = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(current_dir, 'uploads')
@@ -108,40 +163,25 @@ def upload_file():
         # Save the file
         filename = secure_filename(video_file.filename)
         file_path = os.path.join(UPLOAD_FOLDER, filename)
-        video_file.save(file_path)
+        save_upload(video_file, file_path)
         logger.info(f"Saved video to: {file_path}")
         
-        # Process video to get frames
-        frames = process_video(file_path)
+        # Process video to get frames, optionally subsampling
+        stride = int(request.args.get('stride', 1))
+        frames = process_video(file_path, stride=stride)
         logger.info(f"Processed video, shape: {frames.shape}")
         
-        # Convert frames to base64 for preview
-        encoded_frames = []
-        for frame in frames:
-            # Ensure frame is uint8
-            if frame.dtype != np.uint8:
-                if frame.max() > 1:
-                    frame = (frame / frame.max() * 255).astype(np.uint8)
-                else:
-                    frame = (frame * 255).astype(np.uint8)
-            
-            # Convert to RGB if needed
-            if len(frame.shape) == 2:
-                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
-            elif frame.shape[-1] == 4:
-                frame = frame[..., :3]
-            
-            # Encode frame
-            _, buffer = cv2.imencode('.png', frame)
-            encoded_frame = base64.b64encode(buffer).decode('utf-8')
-            encoded_frames.append(encoded_frame)
-        
+        # Convert frames to base64 for preview (JPEG unless lossless requested)
+        lossless = request.args.get('format', 'jpeg').lower() == 'png'
+        encoded_frames = encode_preview_frames(frames, lossless=lossless)
+
         logger.info(f"Encoded {len(encoded_frames)} frames")
         
         return jsonify({
             'message': 'File uploaded successfully',
             'path': file_path,
-            'frames': encoded_frames
+            'frames': encoded_frames,
+            'frame_mime': 'image/png' if lossless else 'image/jpeg'
         })
         
     except Exception as e:
@@ -152,8 +192,8 @@ def upload_file():
 def upload_mask():
     """Handle mask file upload."""
     logger.info("Received mask upload request")
-    logger.debug(f"Files in request: {request.files.keys()}")
-    logger.debug(f"Request headers: {dict(request.headers)}")
+    logger.debug("Files in request: %s", request.files.keys())
+    logger.debug("Request headers: %s", request.headers)
     
     try:
         if 'file' not in request.files:
@@ -173,14 +213,14 @@ def upload_mask():
         # Save the uploaded file
         mask_path = os.path.join(UPLOAD_FOLDER, secure_filename(file.filename))
         logger.info(f"Saving mask to: {mask_path}")
-        file.save(mask_path)
+        save_upload(file, mask_path)
         logger.info(f"File saved successfully. Size: {os.path.getsize(mask_path)} bytes")
         
         # Process the mask
         logger.info("Processing mask")
         result = process_mask(mask_path)
         logger.info("Mask processed successfully")
-        logger.debug(f"Number of cells detected: {len(result['cell_ids'])}")
+        logger.debug("Number of cells detected: %d", len(result['cell_ids']))
         
         response_data = {
             'message': 'Mask uploaded successfully',
@@ -189,7 +229,7 @@ def upload_mask():
             'cell_ids': result['cell_ids']
         }
         logger.info("Sending response")
-        logger.debug(f"Response data keys: {response_data.keys()}")
+        logger.debug("Response data keys: %s", response_data.keys())
         
         return jsonify(response_data)
         
@@ -216,8 +256,9 @@ def analyze_video():
         
         logger.info(f"Analyzing video: {video_path}")
         
-        # Process video and get frames
-        frames = process_video(video_path)
+        # Process video and get frames, optionally subsampling
+        stride = int(data.get('stride', 1))
+        frames = process_video(video_path, stride=stride)
         logger.info(f"Loaded video with shape: {frames.shape}")
         
         if mask_path:
@@ -277,51 +318,62 @@ def analyze_video():
         
         logger.info(f"Found {n_cells} unique cells")
         
-        # Create mask preview with cell labels
-        mask_rgb = np.zeros((*masks.shape, 3), dtype=np.uint8)
-        
-        # Generate distinct colors for each cell
-        colors = []
-        for i in range(n_cells):
-            hue = i / max(n_cells, 1)
-            rgb = tuple(int(x * 255) for x in colorsys.hsv_to_rgb(hue, 0.8, 0.9))
-            colors.append(rgb)
-        
-        # Color each cell
-        for i, cell_id in enumerate(unique_cells):
-            cell_mask = masks == cell_id
-            mask_rgb[cell_mask] = colors[i]
+        # Generate distinct colors for each cell in one vectorized pass
+        colors = generate_cell_colors(n_cells)
+
+        # Color all cells in one palette gather instead of one full-mask
+        # scan per cell (index 0 stays black for the background)
+        palette = np.zeros((int(masks.max()) + 1, 3), dtype=np.uint8)
+        palette[unique_cells] = colors
+        mask_rgb = palette[masks]
         
-        # Add cell numbers
+        # Add cell numbers; all centroids come from one C pass over the labels
         mask_with_labels = mask_rgb.copy()
-        for i, cell_id in enumerate(unique_cells):
-            cell_mask = masks == cell_id
-            y, x = np.where(cell_mask)
-            if len(y) > 0 and len(x) > 0:
-                center_y = int(np.mean(y))
-                center_x = int(np.mean(x))
-                label = str(int(cell_id))
-                # Add black outline
-                cv2.putText(mask_with_labels, label, (center_x, center_y),
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 2)
-                # Add white text
-                cv2.putText(mask_with_labels, label, (center_x, center_y),
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+        centers = ndimage.center_of_mass(np.ones_like(masks, dtype=np.uint8),
+                                         masks, unique_cells)
+        for (center_y, center_x), cell_id in zip(centers, unique_cells):
+            label = str(int(cell_id))
+            center = (int(center_x), int(center_y))
+            # Add black outline
+            cv2.putText(mask_with_labels, label, center,
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 2)
+            # Add white text
+            cv2.putText(mask_with_labels, label, center,
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
         
         # Save mask
         os.makedirs(MASK_FOLDER, exist_ok=True)
         mask_path = os.path.join(MASK_FOLDER, 'latest_mask.tiff')
-        tifffile.imwrite(mask_path, masks)
+        # Zstd + horizontal differencing shrinks label images ~10-20x;
+        # tiling allows partial reads when previews are regenerated
+        mask_out = masks.astype(np.uint16 if masks.max() < 65536 else np.uint32)
+        tifffile.imwrite(mask_path, mask_out,
+                         compression='zstd', compressionargs={'level': 3},
+                         predictor=True, bigtiff=True, tile=(512, 512))
         logger.info(f"Saved mask to: {mask_path}")
         
-        # Analyze calcium intensity
+        # Analyze calcium intensity. Keyed by the video bytes, the mask
+        # actually used and the stride, a repeat of the same analysis
+        # (e.g. while iterating on plot styles) is a single parquet read
         try:
-            intensity_df = analyze_calcium_intensity(frames, masks)
-            
-            # Save results
             os.makedirs(RESULTS_FOLDER, exist_ok=True)
+            mask_digest = hashlib.sha256(np.ascontiguousarray(masks)).hexdigest()
+            cache_key = hashlib.sha256(
+                f'{file_digest(video_path)}:{mask_digest}:{stride}'.encode()
+            ).hexdigest()
+            cache_path = os.path.join(RESULTS_FOLDER, f'analysis_{cache_key}.parquet')
+            if os.path.exists(cache_path):
+                logger.info(f"Analysis cache hit: {cache_path}")
+                intensity_df = pd.read_parquet(cache_path)
+            else:
+                intensity_df = analyze_calcium_intensity(frames, masks)
+                intensity_df.to_parquet(cache_path)
+
+            # Save results
             results_path = os.path.join(RESULTS_FOLDER, 'intensity_data.csv')
             intensity_df.to_csv(results_path, index=False)
+            # Parquet sibling is what the read paths prefer
+            intensity_df.to_parquet(results_path.replace('.csv', '.parquet'))
             logger.info(f"Saved results to: {results_path}")
             
             # Generate plot
@@ -337,16 +389,17 @@ def analyze_video():
             logger.exception("Error in calcium intensity analysis")
             raise ValueError(f"Calcium intensity analysis failed: {str(e)}")
         
-        # Convert mask preview to base64
-        _, buffer = cv2.imencode('.png', mask_with_labels)
-        mask_preview_b64 = base64.b64encode(buffer).decode('utf-8')
-        logger.info("Generated mask preview with cell labels")
-        
+        # Write the preview to disk and reference it by URL; base64 in
+        # JSON inflates the payload ~33% and bypasses sendfile
+        preview_path = os.path.join(MASK_FOLDER, 'latest_preview.png')
+        cv2.imwrite(preview_path, mask_with_labels)
+        logger.info("Saved mask preview with cell labels")
+
         return jsonify({
             'message': 'Analysis complete',
             'results_path': results_path,
             'mask_path': mask_path,
-            'mask_preview': mask_preview_b64,
+            'mask_preview_url': '/masks/latest_preview.png',
             'plot': plot_b64,
             'n_cells': n_cells
         })
@@ -365,12 +418,17 @@ def get_csv_data():
         if not path or not os.path.exists(path):
             raise ValueError(f"CSV file not found: {path}")
 
-        # Read CSV file
-        df = pd.read_csv(path)
-        
-        # Convert DataFrame to list of dictionaries
-        data = df.to_dict('records')
-        columns = list(df.columns)
+        # Read straight from Parquet when a current sibling exists,
+        # skipping pandas
+        parquet_path = parquet_sibling(path)
+        if parquet_path:
+            table = pq.read_table(parquet_path)
+            data = table.to_pylist()
+            columns = table.column_names
+        else:
+            df = pd.read_csv(path)
+            data = df.to_dict('records')
+            columns = list(df.columns)
 
         return jsonify({
             'data': data,
@@ -392,177 +450,32 @@ def generate_plot():
         cells = data.get('cells', [])
         results_path = data.get('results_path')
         plot_options = data.get('plot_options', {})
-        
-        # Get plot preferences
-        y_axis = plot_options.get('y_axis', 'intensity')
-        x_axis = plot_options.get('x_axis', 'frame')
-        
-        # Get style options
-        style_options = plot_options.get('style', {})
-        theme = style_options.get('theme', 'minimal')
-        line_size = style_options.get('line_size', 1)
-        show_points = style_options.get('show_points', False)
-        point_size = style_options.get('point_size', 2)
-        fill_alpha = style_options.get('fill_alpha', 0)
-        color_palette = style_options.get('color_palette', 'Set1')
-        background_color = style_options.get('background', None)
-        grid_color = style_options.get('grid_color', 'grey80')
-        grid_style = style_options.get('grid_style', 'both')
-        y_scale = style_options.get('y_scale', 'regular')
-        axis_text_size = style_options.get('axis_text_size', 10)
-        legend_position = style_options.get('legend_position', 'right')
-        smooth_lines = style_options.get('smooth_lines', False)
-        smooth_span = style_options.get('smooth_span', 0.75)
-        show_error_bands = style_options.get('show_error_bands', False)
 
         if not cells:
             raise ValueError("No cells selected")
         if not results_path or not os.path.exists(results_path):
             raise ValueError(f"Results file not found: {results_path}")
 
+        # Serve a cached render when nothing affecting the output changed
+        cache_key = plot_cache_key(results_path, cells, plot_options)
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            logger.info("Returning cached plot")
+            return jsonify(cached_response)
+
         # Read the CSV data
-        df = pd.read_csv(results_path)
-        
+        df = load_results(results_path)
+
         # Filter data for selected cells
         df_filtered = df[df['cell_id'].isin(cells)].copy()
-        df_filtered['cell_id'] = 'Cell ' + df_filtered['cell_id'].astype(str)
-        
-        # Create temporary file for plot
-        temp_plot = os.path.join(PLOT_FOLDER, f'plot_{int(time.time())}.png')
-        
-        # Generate colors using HSV color space
-        n_cells = len(cells)
-        logger.info(f"Generating colors for {n_cells} cells")
-        
-        # Create R color vector
-        if n_cells > 9:  # If more than 9 cells, generate custom colors
-            hsv_colors = np.zeros((n_cells, 3))
-            hsv_colors[:, 0] = np.linspace(0, 1, n_cells, endpoint=False)  # Hue
-            hsv_colors[:, 1] = 0.8  # Saturation
-            hsv_colors[:, 2] = 0.9  # Value
-            
-            # Convert to RGB
-            rgb_colors = cv2.cvtColor(
-                (hsv_colors.reshape(1, -1, 3) * 255).astype(np.uint8),
-                cv2.COLOR_HSV2RGB
-            )[0]
-            
-            # Convert to R color strings
-            r_colors = [f'"#{r:02x}{g:02x}{b:02x}"' for r, g, b in rgb_colors]
-            color_scale = f'scale_color_manual(values=c({",".join(r_colors)}))'
-            if fill_alpha > 0:
-                fill_scale = f'scale_fill_manual(values=c({",".join(r_colors)}))'
-            else:
-                fill_scale = ''
-        else:
-            # Use RColorBrewer palette for 9 or fewer cells
-            color_scale = f'scale_color_brewer(palette="{color_palette}")'
-            fill_scale = f'scale_fill_brewer(palette="{color_palette}")' if fill_alpha > 0 else ''
-        
-        # Use localconverter for R operations
-        with localconverter(default_converter + pandas2ri.converter) as cv:
-            # Convert to R dataframe
-            r_df = pandas2ri.py2rpy(df_filtered)
-            
-            # Create the R environment and assign data
-            r_env = ro.Environment()
-            r_env['df'] = r_df
-            
-            # Prepare plot options
-            y_label = 'ΔF/F' if y_axis == 'dF' else y_axis.replace('_', ' ').title()
-            x_label = 'Time (seconds)' if x_axis == 'time_seconds' else 'Frame Number'
-            
-            # Create R plotting commands with dynamic options
-            r_code = f"""
-                function(df) {{
-                    library(ggplot2)
-                    library(scales)
-                    
-                    # Base plot
-                    p <- ggplot(df, aes(x={x_axis}, y={y_axis}, color=cell_id)) +
-                        {color_scale}
-                    
-                    # Add geom based on smoothing option
-                    {f'''
-                    if ({str(smooth_lines).upper()}) {{
-                        p <- p + geom_smooth(
-                            method="loess",
-                            span={smooth_span},
-                            se={str(show_error_bands).upper()},
-                            size={line_size}
-                        )
-                    }} else {{
-                        p <- p + geom_line(size={line_size})
-                    }}
-                    ''' if smooth_lines else f'p <- p + geom_line(size={line_size})'}
-                    
-                    # Add points if requested
-                    {f'p <- p + geom_point(size={point_size})' if show_points else ''}
-                    
-                    # Add fill if requested
-                    {f'''
-                    p <- p + geom_ribbon(
-                        aes(ymin=min({y_axis}), ymax={y_axis}, fill=cell_id),
-                        alpha={fill_alpha}
-                    ) +
-                    {fill_scale}
-                    ''' if fill_alpha > 0 else ''}
-                    
-                    # Scale options
-                    {f'p <- p + scale_y_log10()' if y_scale == 'log' else ''}
-                    
-                    # Theme selection
-                    p <- p + theme_{theme}()
-                    
-                    # Grid style
-                    {'''
-                    if (grid_style == "none") {
-                        p <- p + theme(panel.grid = element_blank())
-                    } else if (grid_style == "major") {
-                        p <- p + theme(panel.grid.minor = element_blank())
-                    }
-                    ''' if grid_style != 'both' else ''}
-                    
-                    # Labels
-                    p <- p + labs(
-                        title='Calcium Imaging Analysis',
-                        x='{x_label}',
-                        y='{y_label}',
-                        color='Cell ID',
-                        fill='Cell ID'
-                    )
-                    
-                    # Custom theme elements
-                    p <- p + theme(
-                        plot.title = element_text(size=14, face="bold", hjust=0.5),
-                        axis.title = element_text(size=12),
-                        axis.text = element_text(size={axis_text_size}),
-                        legend.position = "{legend_position}",
-                        legend.title = element_text(size=12),
-                        legend.text = element_text(size=10),
-                        panel.grid.major = element_line(color="{grid_color}"),
-                        panel.grid.minor = element_line(color="{grid_color}", linetype="dotted"),
-                        {f'plot.background = element_rect(fill="{background_color}")' if background_color else ''}
-                    )
-                    
-                    # Save plot with high resolution
-                    ggsave('{temp_plot}', p, width=10, height=6, dpi=300)
-                }}
-            """
-            
-            # Execute R code
-            ro.r(r_code)(r_df)
-        
-        # Read and encode plot
-        with open(temp_plot, 'rb') as f:
-            plot_data = base64.b64encode(f.read()).decode('utf-8')
-        
-        # Clean up
-        os.remove(temp_plot)
-        
-        return jsonify({
-            'plot': plot_data
-        })
+
+        # Render via the shared plot pipeline; cache the whole response
+        # so hits and misses share one contract
+        plot_response = create_plot_from_data(df_filtered, plot_options)
+
+        cache.set(cache_key, plot_response)
+
+        return jsonify(plot_response)
 
     except Exception as e:
         logger.exception("Error generating plot")
@@ -575,7 +488,7 @@ def export_csv():
     
     try:
         data = request.get_json()
-        logger.debug(f"Export request data: {data}")
+        logger.debug("Export request data: %s", data)
         
         if not data or 'results_path' not in data:
             logger.error("No results path provided")
@@ -592,24 +505,15 @@ def export_csv():
             logger.error("No cells selected for export")
             return jsonify({'error': 'No cells selected for export'}), 400
             
-        # Read the original CSV
-        df = pd.read_csv(results_path)
-        
-        # Filter for selected cells
-        df = df[df['cell_id'].isin(selected_cells)]
-        
-        # Calculate dF/F for each cell
-        cells = df['cell_id'].unique()
-        df_list = []
+        # Read the results table
+        df = load_results(results_path)
+
+        # Select via a sorted index instead of an isin scan over all rows
+        df = df.set_index('cell_id').sort_index()
+        df = df.loc[df.index.intersection(selected_cells)].reset_index()
         
-        for cell in cells:
-            cell_data = df[df['cell_id'] == cell].copy()
-            intensities = cell_data['intensity'].values
-            cell_data['dF'] = calculate_df(intensities)
-            cell_data['time_seconds'] = cell_data['frame'] / 30  # Assuming 30fps
-            df_list.append(cell_data)
-            
-        final_df = pd.concat(df_list) if df_list else pd.DataFrame()
+        # Calculate dF/F for all cells in one vectorized pass
+        final_df = add_df_columns(df) if not df.empty else pd.DataFrame()
         
         # Save to new file with timestamp
         timestamp = int(time.time())
@@ -645,7 +549,7 @@ def import_csv():
         # Save the uploaded file
         filename = secure_filename(file.filename)
         import_path = os.path.join(RESULTS_FOLDER, filename)
-        file.save(import_path)
+        save_upload(file, import_path)
         
         # Validate CSV format
         df = pd.read_csv(import_path)
@@ -658,17 +562,7 @@ def import_csv():
             
         # Calculate dF if not present
         if 'dF' not in df.columns:
-            cells = df['cell_id'].unique()
-            df_list = []
-            
-            for cell in cells:
-                cell_data = df[df['cell_id'] == cell].copy()
-                intensities = cell_data['intensity'].values
-                cell_data['dF'] = calculate_df(intensities)
-                cell_data['time_seconds'] = cell_data['frame'] / 30  # Assuming 30fps
-                df_list.append(cell_data)
-                
-            df = pd.concat(df_list)
+            df = add_df_columns(df)
             df.to_csv(import_path, index=False)
         
         return jsonify({
@@ -684,7 +578,21 @@ def import_csv():
 @app.route('/results/<path:filename>')
 def serve_results(filename):
     """Serve files from the results folder."""
-    return send_from_directory(RESULTS_FOLDER, filename)
+    return send_from_directory(RESULTS_FOLDER, filename, conditional=True)
+
+@app.route('/masks/<path:filename>')
+def serve_mask(filename):
+    """Serve mask previews from the mask folder."""
+    response = send_from_directory(MASK_FOLDER, filename)
+    response.headers['Cache-Control'] = 'max-age=60'
+    return response
+
+@app.route('/plots/<path:filename>')
+def serve_plot(filename):
+    """Serve rendered plots from the plot folder."""
+    response = send_from_directory(PLOT_FOLDER, filename)
+    response.headers['Cache-Control'] = 'max-age=60'
+    return response
 
 @app.route('/generate-plot', methods=['POST'])
 def generate_plot_endpoint():
@@ -703,15 +611,25 @@ def generate_plot_endpoint():
         if not results_path or not os.path.exists(results_path):
             raise ValueError(f"Results file not found: {results_path}")
 
+        # Serve a cached render when nothing affecting the output
+        # changed. The key is shared with /plot, so both handlers cache
+        # the same render dict and project their response shape from it
+        cache_key = plot_cache_key(results_path, cells, options)
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            logger.info("Returning cached plot")
+            return jsonify({'plot_image': cached_response.get('plot')})
+
         # Read the CSV data
-        df = pd.read_csv(results_path)
-        
+        df = load_results(results_path)
+
         # Filter data for selected cells
         df_filtered = df[df['cell_id'].isin(cells)].copy()
-        
+
         # Generate plot
         plot_response = create_plot_from_data(df_filtered, options)
-        
+        cache.set(cache_key, plot_response)
+
         return jsonify({
             'plot_image': plot_response.get('plot')
         })
@@ -732,22 +650,12 @@ def export_all_csv():
         if not os.path.exists(results_path):
             raise ValueError(f"Results file not found: {results_path}")
         
-        # Read the original CSV
-        df = pd.read_csv(results_path)
-        
-        # Calculate dF/F for each cell if not already present
+        # Read the results table
+        df = load_results(results_path)
+
+        # Calculate dF/F for all cells if not already present
         if 'dF' not in df.columns:
-            cells = df['cell_id'].unique()
-            df_list = []
-            
-            for cell in cells:
-                cell_data = df[df['cell_id'] == cell].copy()
-                intensities = cell_data['intensity'].values
-                cell_data['dF'] = calculate_df(intensities)
-                cell_data['time_seconds'] = cell_data['frame'] / 30  # Assuming 30fps
-                df_list.append(cell_data)
-                
-            df = pd.concat(df_list)
+            df = add_df_columns(df)
         
         # Save to new file with timestamp
         timestamp = int(time.time())
@@ -778,10 +686,13 @@ def download_file():
         filename = os.path.basename(path)
         directory = os.path.dirname(path)
         
+        # conditional=True honors Range/If-Modified-Since, so retries
+        # resume instead of re-shipping the whole file
         return send_from_directory(
             directory,
             filename,
-            as_attachment=True
+            as_attachment=True,
+            conditional=True
         )
         
     except Exception as e:
@@ -811,54 +722,57 @@ def analyze_calcium_intensity(frames, masks):
         # Ensure cells are labeled sequentially from 1 to N
         if not np.array_equal(unique_cells, np.arange(1, len(unique_cells) + 1)):
             logger.info("Cell IDs are not sequential, relabeling...")
-            relabeled_mask = np.zeros_like(masks)
-            for new_id, original_id in enumerate(unique_cells, 1):
-                relabeled_mask[masks == original_id] = new_id
-            masks = relabeled_mask
+            # Single LUT gather instead of one full-mask scan per cell
+            lut = np.zeros(int(masks.max()) + 1, dtype=masks.dtype)
+            lut[unique_cells] = np.arange(1, len(unique_cells) + 1)
+            masks = lut[masks]
             unique_cells = np.arange(1, len(unique_cells) + 1)
             logger.info(f"Relabeled mask cells to be sequential from 1 to {len(unique_cells)}")
         
-        # Initialize list to store results
-        results = []
-        
-        # For each frame
-        for frame_idx, frame in enumerate(frames):
-            # Convert frame to grayscale if it's RGB
-            if len(frame.shape) == 3:
-                frame = frame[..., 1]  # Use green channel for fluorescence
-            
-            # For each cell
-            for cell_id in unique_cells:
-                # Get cell mask
-                cell_mask = masks == cell_id
-                
-                # Calculate mean intensity for the cell in this frame
-                mean_intensity = np.mean(frame[cell_mask])
-                
-                # Store results
-                results.append({
-                    'frame': frame_idx,
-                    'cell_id': int(cell_id),
-                    'intensity': float(mean_intensity)
-                })
-        
-        # Convert to DataFrame
-        df = pd.DataFrame(results)
-        
-        # Calculate baseline for each cell (first frame intensity)
-        baselines = {}
-        for cell_id in unique_cells:
-            first_frame_data = df[(df['cell_id'] == cell_id) & (df['frame'] == 0)]
-            if not first_frame_data.empty:
-                baselines[cell_id] = first_frame_data['intensity'].values[0]
-            else:
-                # Fallback to mean of first few frames if first frame is missing
-                baselines[cell_id] = df[df['cell_id'] == cell_id].nsmallest(min(10, len(df[df['cell_id'] == cell_id])), 'intensity')['intensity'].mean()
+        # Use the green channel for fluorescence. Slice it once for the
+        # whole stack and make it contiguous so each per-frame reduction
+        # below is a single stride-1 sweep instead of F strided views
+        gray = np.ascontiguousarray(frames[..., 1]) if frames.ndim == 4 else frames
+        n_frames = gray.shape[0]
+
+        if isinstance(gray, np.memmap):
+            # Memory-mapped stacks stream through scipy's fused
+            # gather-reduce one frame at a time, so only the current
+            # frame is ever resident
+            means = np.stack([
+                ndimage.mean(gray[f], labels=masks, index=unique_cells)
+                for f in range(n_frames)
+            ])
+        else:
+            # In-memory stacks go through one compiled kernel: a serial
+            # pass counts pixels per cell, then prange spreads the
+            # per-frame accumulation across every core
+            means = _cell_means(np.ascontiguousarray(gray), masks,
+                                len(unique_cells))
+
+        # Build the results frame straight from the means matrix: three
+        # column arrays instead of F*C per-row dicts for pandas to
+        # type-infer
+        df = pd.DataFrame({
+            'frame': np.repeat(np.arange(n_frames), len(unique_cells)),
+            'cell_id': np.tile(unique_cells, n_frames),
+            'intensity': means.ravel().astype(np.float64),
+        })
         
-        # Add normalized intensity (as a percentage of baseline)
-        df['normalized_intensity'] = df.apply(
-            lambda row: (row['intensity'] / baselines[row['cell_id']]),
-            axis=1
+        # Baseline for each cell is the first-frame intensity, which is
+        # just the first row of the means matrix — no per-cell DataFrame
+        # filtering needed. Every cell appears in every frame here, so
+        # there is no missing-first-frame case to fall back on.
+        baseline_arr = means[0]
+
+        # Add normalized intensity (as a percentage of baseline); cell ids
+        # are sequential, so a baseline array indexed by id-1 replaces the
+        # per-row dict lookup. numexpr streams the divide through all
+        # cores in cache-sized chunks without an intermediate temporary.
+        df['normalized_intensity'] = ne.evaluate(
+            'i / b',
+            local_dict={'i': df['intensity'].to_numpy(),
+                        'b': baseline_arr[df['cell_id'].to_numpy() - 1]}
         )
         
         logger.info(f"Generated intensity data with shape: {df.shape}")
@@ -871,208 +785,367 @@ def analyze_calcium_intensity(frames, masks):
 def create_plot_from_data(df, options={}):
     """Create plot directly from DataFrame."""
     logger.info(f"Creating plot from DataFrame with shape: {df.shape}")
-    
+
     try:
-        # Extract plot options
-        y_axis = options.get('y_axis', 'intensity')
-        x_axis = options.get('x_axis', 'frame')
-        style = options.get('style', {})
-        
-        # Style options
-        theme = style.get('theme', 'minimal')
-        line_size = style.get('line_size', 1)
-        show_points = style.get('show_points', False)
-        point_size = style.get('point_size', 2)
-        fill_alpha = style.get('fill_alpha', 0)
-        color_palette = style.get('color_palette', 'Set1')
-        background_color = style.get('background', None)
-        grid_color = style.get('grid_color', 'grey80')
-        grid_style = style.get('grid_style', 'both')
-        y_scale = style.get('y_scale', 'regular')
-        axis_text_size = style.get('axis_text_size', 10)
-        legend_position = style.get('legend_position', 'right')
-        smooth_lines = style.get('smooth_lines', False)
-        smooth_span = style.get('smooth_span', 0.75)
-        show_error_bands = style.get('show_error_bands', False)
-        
-        # Ensure cell_id is a string for better labels
-        df['cell_id'] = 'Cell ' + df['cell_id'].astype(str)
-        
+        # Ensure cell_id reads as a label; a Categorical builds one
+        # "Cell N" string per cell rather than one per row
+        cell_ids = np.sort(df['cell_id'].unique())
+        codes = np.searchsorted(cell_ids, df['cell_id'].to_numpy())
+        df['cell_id'] = pd.Categorical.from_codes(
+            codes, categories=[f'Cell {int(c)}' for c in cell_ids])
+
         # Create temporary file for plot
         os.makedirs(PLOT_FOLDER, exist_ok=True)
         temp_plot = os.path.join(PLOT_FOLDER, f'plot_{int(time.time())}.png')
-        
-        # Generate colors using HSV color space
-        n_cells = len(df['cell_id'].unique())
-        logger.info(f"Generating colors for {n_cells} cells")
-        
-        # Create R color vector
-        if n_cells > 9:  # If more than 9 cells, generate custom colors
-            hsv_colors = np.zeros((n_cells, 3))
-            hsv_colors[:, 0] = np.linspace(0, 1, n_cells, endpoint=False)  # Hue
-            hsv_colors[:, 1] = 0.8  # Saturation
-            hsv_colors[:, 2] = 0.9  # Value
-            
-            # Convert to RGB
-            rgb_colors = cv2.cvtColor(
-                (hsv_colors.reshape(1, -1, 3) * 255).astype(np.uint8),
-                cv2.COLOR_HSV2RGB
-            )[0]
-            
-            # Convert to R color strings
-            r_colors = [f'"#{r:02x}{g:02x}{b:02x}"' for r, g, b in rgb_colors]
-            color_scale = f'scale_color_manual(values=c({",".join(r_colors)}))'            
-            if fill_alpha > 0:
-                fill_scale = f'scale_fill_manual(values=c({",".join(r_colors)}))'            
-            else:
-                fill_scale = ''
+
+        if PLOT_BACKEND == 'ggplot2':
+            render_plot_ggplot2(df, options, temp_plot)
+            with open(temp_plot, 'rb') as f:
+                png_bytes = f.read()
         else:
-            # Use RColorBrewer palette for 9 or fewer cells
-            color_scale = f'scale_color_brewer(palette="{color_palette}")'
-            fill_scale = f'scale_fill_brewer(palette="{color_palette}")' if fill_alpha > 0 else ''
-        
-        # Use localconverter for R operations
-        with localconverter(default_converter + pandas2ri.converter) as cv:
-            # Convert to R dataframe
-            r_df = pandas2ri.py2rpy(df)
-            
-            # Create the R environment and assign data
-            r_env = ro.Environment()
-            r_env['df'] = r_df
-            
-            # Prepare plot options
-            y_label = 'ΔF/F' if y_axis == 'dF' else y_axis.replace('_', ' ').title()
-            x_label = 'Time (seconds)' if x_axis == 'time_seconds' else 'Frame Number'
-            
-            # Create R plotting commands with dynamic options
-            r_code = f"""
-                function(df) {{
-                    library(ggplot2)
-                    library(scales)
-                    
-                    # Base plot
-                    p <- ggplot(df, aes(x={x_axis}, y={y_axis}, color=cell_id)) +
-                        {color_scale}
-                    
-                    # Add geom based on smoothing option
-                    {f'''
-                    if ({str(smooth_lines).upper()}) {{
-                        p <- p + geom_smooth(
-                            method="loess",
-                            span={smooth_span},
-                            se={str(show_error_bands).upper()},
-                            size={line_size}
-                        )
-                    }} else {{
-                        p <- p + geom_line(size={line_size})
-                    }}
-                    ''' if smooth_lines else f'p <- p + geom_line(size={line_size})'}
-                    
-                    # Add points if requested
-                    {f'p <- p + geom_point(size={point_size})' if show_points else ''}
-                    
-                    # Add fill if requested
-                    {f'''
-                    p <- p + geom_ribbon(
-                        aes(ymin=min({y_axis}), ymax={y_axis}, fill=cell_id),
-                        alpha={fill_alpha}
-                    ) +
-                    {fill_scale}
-                    ''' if fill_alpha > 0 else ''}
-                    
-                    # Scale options
-                    {f'p <- p + scale_y_log10()' if y_scale == 'log' else ''}
-                    
-                    # Theme selection
-                    p <- p + theme_{theme}()
-                    
-                    # Grid style
-                    {'''
-                    if (grid_style == "none") {
-                        p <- p + theme(panel.grid = element_blank())
-                    } else if (grid_style == "major") {
-                        p <- p + theme(panel.grid.minor = element_blank())
-                    }
-                    ''' if grid_style != 'both' else ''}
-                    
-                    # Labels
-                    p <- p + labs(
-                        title='Calcium Imaging Analysis',
-                        x='{x_label}',
-                        y='{y_label}',
-                        color='Cell ID',
-                        fill='Cell ID'
-                    )
-                    
-                    # Custom theme elements
-                    p <- p + theme(
-                        plot.title = element_text(size=14, face="bold", hjust=0.5),
-                        axis.title = element_text(size=12),
-                        axis.text = element_text(size={axis_text_size}),
-                        legend.position = "{legend_position}",
-                        legend.title = element_text(size=12),
-                        legend.text = element_text(size=10),
-                        panel.grid.major = element_line(color="{grid_color}"),
-                        panel.grid.minor = element_line(color="{grid_color}", linetype="dotted"),
-                        {f'plot.background = element_rect(fill="{background_color}")' if background_color else ''}
-                    )
-                    
-                    # Save plot with high resolution
-                    ggsave('{temp_plot}', p, width=10, height=6, dpi=300)
-                }}
-            """
-            
-            # Execute R code
-            ro.r(r_code)(r_df)
-        
-        # Read and encode plot
-        with open(temp_plot, 'rb') as f:
-            plot_data = base64.b64encode(f.read()).decode('utf-8')
-        
-        # Clean up
-        os.remove(temp_plot)
-        
+            # plotnine renders straight into memory; the write below only
+            # keeps a copy on disk so clients can fetch it from /plots
+            png_bytes = render_plot_plotnine(df, options)
+            with open(temp_plot, 'wb') as f:
+                f.write(png_bytes)
+
+        plot_data = base64.b64encode(png_bytes).decode('utf-8')
+
         return {
-            'plot': plot_data
+            'plot': plot_data,
+            'plot_url': f'/plots/{os.path.basename(temp_plot)}'
         }
-        
+
     except Exception as e:
         logger.exception("Error creating plot from data")
         raise
 
-def process_video(video_path):
-    logger.info(f"Processing video: {video_path}")
-    
+def render_plot_plotnine(df, options):
+    """Render the calcium plot in-process with plotnine, returning PNG bytes.
+
+    Same ggplot2 grammar, but the DataFrame never leaves Python — no
+    converter, no R marshalling, no temp-file round-trip.
+    """
+    # Extract plot options
+    y_axis = options.get('y_axis', 'intensity')
+    x_axis = options.get('x_axis', 'frame')
+    style = options.get('style', {})
+
+    # Style options
+    theme_name = style.get('theme', 'minimal')
+    line_size = style.get('line_size', 1)
+    show_points = style.get('show_points', False)
+    point_size = style.get('point_size', 2)
+    fill_alpha = style.get('fill_alpha', 0)
+    color_palette = style.get('color_palette', 'Set1')
+    background_color = style.get('background', None)
+    grid_color = style.get('grid_color', 'grey80')
+    grid_style = style.get('grid_style', 'both')
+    y_scale = style.get('y_scale', 'regular')
+    axis_text_size = style.get('axis_text_size', 10)
+    legend_position = style.get('legend_position', 'right')
+    smooth_lines = style.get('smooth_lines', False)
+    smooth_span = style.get('smooth_span', 0.75)
+    show_error_bands = style.get('show_error_bands', False)
+
+    n_cells = df['cell_id'].nunique()
+    y_label = 'ΔF/F' if y_axis == 'dF' else y_axis.replace('_', ' ').title()
+    x_label = 'Time (seconds)' if x_axis == 'time_seconds' else 'Frame Number'
+
+    # Base plot
+    p = p9.ggplot(df, p9.aes(x=x_axis, y=y_axis, color='cell_id'))
+
+    # Color scale: brewer palettes top out at 9 classes
+    if n_cells > 9:
+        hex_colors = [f'#{r:02x}{g:02x}{b:02x}' for r, g, b in generate_cell_colors(n_cells)]
+        p += p9.scale_color_manual(values=hex_colors)
+        if fill_alpha > 0:
+            p += p9.scale_fill_manual(values=hex_colors)
+    else:
+        p += p9.scale_color_brewer(type='qual', palette=color_palette)
+        if fill_alpha > 0:
+            p += p9.scale_fill_brewer(type='qual', palette=color_palette)
+
+    # Add geom based on smoothing option
+    if smooth_lines:
+        p += p9.geom_smooth(method='loess', span=smooth_span,
+                            se=show_error_bands, size=line_size)
+    else:
+        p += p9.geom_line(size=line_size)
+
+    # Add points if requested
+    if show_points:
+        p += p9.geom_point(size=point_size)
+
+    # Add fill if requested
+    if fill_alpha > 0:
+        p += p9.geom_ribbon(p9.aes(ymax=y_axis, fill='cell_id'),
+                            ymin=float(df[y_axis].min()), alpha=fill_alpha)
+
+    # Scale options
+    if y_scale == 'log':
+        p += p9.scale_y_log10()
+
+    # Theme selection
+    p += getattr(p9, f'theme_{theme_name}')()
+
+    # Custom theme elements (grid style folded in)
+    theme_kwargs = {
+        'plot_title': p9.element_text(size=14, face='bold', ha='center'),
+        'axis_title': p9.element_text(size=12),
+        'axis_text': p9.element_text(size=axis_text_size),
+        'legend_position': legend_position,
+        'legend_title': p9.element_text(size=12),
+        'legend_text': p9.element_text(size=10),
+        'panel_grid_major': p9.element_line(color=grid_color),
+        'panel_grid_minor': p9.element_line(color=grid_color, linetype='dotted'),
+    }
+    if grid_style == 'none':
+        theme_kwargs['panel_grid'] = p9.element_blank()
+    elif grid_style == 'major':
+        theme_kwargs['panel_grid_minor'] = p9.element_blank()
+    if background_color:
+        theme_kwargs['plot_background'] = p9.element_rect(fill=background_color)
+    p += p9.theme(**theme_kwargs)
+
+    # Labels
+    p += p9.labs(
+        title='Calcium Imaging Analysis',
+        x=x_label,
+        y=y_label,
+        color='Cell ID',
+        fill='Cell ID'
+    )
+
+    # Save plot with high resolution into memory
+    buf = io.BytesIO()
+    p.save(buf, format='png', width=10, height=6, dpi=300, verbose=False)
+    return buf.getvalue()
+
+def render_plot_ggplot2(df, options, temp_plot):
+    """Render the calcium plot through R/ggplot2 (legacy backend)."""
+    # Extract plot options
+    y_axis = options.get('y_axis', 'intensity')
+    x_axis = options.get('x_axis', 'frame')
+    style = options.get('style', {})
+
+    # Style options
+    theme = style.get('theme', 'minimal')
+    line_size = style.get('line_size', 1)
+    show_points = style.get('show_points', False)
+    point_size = style.get('point_size', 2)
+    fill_alpha = style.get('fill_alpha', 0)
+    color_palette = style.get('color_palette', 'Set1')
+    background_color = style.get('background', None)
+    grid_color = style.get('grid_color', 'grey80')
+    grid_style = style.get('grid_style', 'both')
+    y_scale = style.get('y_scale', 'regular')
+    axis_text_size = style.get('axis_text_size', 10)
+    legend_position = style.get('legend_position', 'right')
+    smooth_lines = style.get('smooth_lines', False)
+    smooth_span = style.get('smooth_span', 0.75)
+    show_error_bands = style.get('show_error_bands', False)
+
+    # Explicit colors for >9 cells; an empty vector tells make_plot to
+    # fall back to the RColorBrewer palette
+    n_cells = len(df['cell_id'].unique())
+    if n_cells > 9:
+        colors = ro.StrVector(
+            [f'#{r:02x}{g:02x}{b:02x}' for r, g, b in generate_cell_colors(n_cells)])
+    else:
+        colors = ro.StrVector([])
+
+    y_label = 'ΔF/F' if y_axis == 'dF' else y_axis.replace('_', ' ').title()
+    x_label = 'Time (seconds)' if x_axis == 'time_seconds' else 'Frame Number'
+
+    # Share the DataFrame with R via Arrow buffers instead of copying per column
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with localconverter(default_converter + pyra.converter) as cv:
+        # Zero-copy handoff to an R arrow Table
+        r_df = pyra.pyarrow_table_to_r_table(table)
+
+        # make_plot is parsed and byte-compiled once at startup
+        # (plot_calcium.R); only values cross the boundary per request
+        ro.globalenv['make_plot'](
+            r_df, temp_plot, x_axis, y_axis, x_label, y_label,
+            colors, color_palette, theme, float(line_size),
+            bool(show_points), float(point_size), float(fill_alpha),
+            y_scale, grid_style, grid_color, float(axis_text_size),
+            legend_position, bool(smooth_lines), float(smooth_span),
+            bool(show_error_bands), background_color or '')
+
+def plot_cache_key(results_path, cells, options):
+    """Cache key for a rendered plot: results mtime + cells + options."""
+    payload = json.dumps(
+        [os.path.getmtime(results_path), sorted(cells), options],
+        sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def file_digest(path):
+    """sha256 of a file's contents, streamed in 1 MB chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def parquet_sibling(path):
+    """Return the Parquet sibling of a CSV path, or None if it is stale.
+
+    A sibling older than the CSV means the CSV was replaced after the
+    analysis wrote it (e.g. via /import-csv); the CSV wins then.
+    """
+    parquet_path = path.replace('.csv', '.parquet')
+    if os.path.exists(parquet_path) and (
+            not os.path.exists(path)
+            or os.path.getmtime(parquet_path) >= os.path.getmtime(path)):
+        return parquet_path
+    return None
+
+def load_results(path):
+    """Read a results table, memoized on (path, mtime).
+
+    Prefers a current Parquet sibling written by /analyze; Parquet decode
+    is SIMD-accelerated and typed, so it's much faster than CSV parsing.
+    """
+    parquet_path = parquet_sibling(path)
+    if parquet_path:
+        source, reader = parquet_path, pd.read_parquet
+    else:
+        source, reader = path, pd.read_csv
+    key = f'results:{source}:{os.path.getmtime(source)}'
+    df = cache.get(key)
+    if df is None:
+        df = reader(source)
+        cache.set(key, df)
+    return df
+
+def save_upload(file_storage, path):
+    """Stream an uploaded file to disk in 1 MB chunks.
+
+    FileStorage.save buffers the whole upload before writing, which
+    doubles RAM use for multi-GB calcium videos.
+    """
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(file_storage.stream, out, length=1024 * 1024)
+
+@functools.lru_cache(maxsize=None)
+def generate_cell_colors(n_cells):
+    """Build n distinct RGB colors with one vectorized HSV->RGB conversion.
+
+    Memoized per cell count; callers must not mutate the returned array.
+    """
+    hues = np.linspace(0, 180, n_cells, endpoint=False).astype(np.uint8)
+    hsv = np.stack([hues,
+                    np.full_like(hues, 204),   # saturation 0.8
+                    np.full_like(hues, 230)],  # value 0.9
+                   axis=-1)[None, :, :]
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)[0]
+
+def encode_preview_frames(frames, lossless=False):
+    """Encode frames to base64 previews, JPEG via libjpeg-turbo by default.
+
+    Pass lossless=True to keep the PNG path for callers that need it.
+    """
+    frames = np.asarray(frames)
+
+    # One scan fixes the scale for the whole stack, but the conversion
+    # itself runs per frame in the workers — scaling the full stack at
+    # once would materialize a float copy of the video (and defeat the
+    # memmap streaming for uint16 TIFFs)
+    if frames.dtype != np.uint8:
+        peak = float(frames.max()) if frames.size else 1.0
+        scale = 255.0 / peak if peak > 1 else 255.0
+    else:
+        scale = None
+
+    def encode_frame(frame):
+        if scale is not None:
+            frame = (frame * scale).astype(np.uint8)
+
+        # Convert to RGB if needed
+        if len(frame.shape) == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+        elif frame.shape[-1] == 4:
+            frame = frame[..., :3]
+
+        if lossless or turbo_jpeg is None:
+            _, buffer = cv2.imencode('.png' if lossless else '.jpg', frame)
+            data = buffer.tobytes()
+        else:
+            data = turbo_jpeg.encode(np.ascontiguousarray(frame), quality=85)
+        return base64.b64encode(data).decode('utf-8')
+
+    # Both encoders release the GIL, so threads scale with cores
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(encode_frame, frames))
+
+def process_video(video_path, stride=1):
+    logger.info(f"Processing video: {video_path} (stride={stride})")
+    stride = max(int(stride), 1)
+
     try:
         if video_path.endswith(('.tiff', '.tif', '.ome.tiff')):
-            frames = tifffile.imread(video_path)
+            # Memory-map the stack so frames are paged in as consumed
+            # instead of materializing the whole video up front
+            frames = tifffile.imread(video_path, out='memmap')
+            if stride > 1:
+                frames = frames[::stride]
             logger.info(f"Loaded TIFF file with shape: {frames.shape}")
         else:
             cap = cv2.VideoCapture(video_path)
-            frames = []
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                frames.append(frame)
+            # Let NVDEC/QSV handle decoding of the retained frames when available
+            cap.set(cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY)
+            n_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+
+            # grab() only advances the demuxer; retrieve() decodes, so
+            # skipped frames never run the codec
+            if n_total > 0 and height > 0 and width > 0:
+                # Decode into a preallocated array; appending to a list
+                # and stacking would hold the video in memory twice
+                n_kept = (n_total + stride - 1) // stride
+                frames = np.empty((n_kept, height, width, 3), dtype=np.uint8)
+                kept = 0
+                frame_idx = 0
+                while kept < n_kept and cap.grab():
+                    if frame_idx % stride == 0:
+                        ret, frame = cap.retrieve()
+                        if ret:
+                            frames[kept] = frame
+                            kept += 1
+                    frame_idx += 1
+                # Container metadata can overestimate the frame count
+                frames = frames[:kept]
+            else:
+                # Frame count unknown (e.g. raw streams): fall back to append
+                frames = []
+                frame_idx = 0
+                while cap.grab():
+                    if frame_idx % stride == 0:
+                        ret, frame = cap.retrieve()
+                        if ret:
+                            frames.append(frame)
+                    frame_idx += 1
+                frames = np.array(frames)
             cap.release()
-            frames = np.array(frames)
             logger.info(f"Loaded video file with shape: {frames.shape}")
         
-        # Ensure frames are in the correct format (N, H, W, C)
+        # Ensure frames are stacked (N, H, W) or (N, H, W, C). Grayscale
+        # stays single-channel — expanding to RGB here would triple
+        # memory; consumers expand per frame only where they need it
         if len(frames.shape) == 2:  # Single frame, grayscale
-            frames = frames[np.newaxis, ..., np.newaxis]
-        elif len(frames.shape) == 3:
-            if frames.shape[-1] in [1, 3, 4]:  # Single frame with channels
-                frames = frames[np.newaxis, ...]
-            else:  # Multiple frames without channels
-                frames = frames[..., np.newaxis]
-        
-        # Convert to RGB if necessary
-        if frames.shape[-1] == 1:
-            frames = np.repeat(frames, 3, axis=-1)
-        elif frames.shape[-1] == 4:
-            frames = frames[..., :3]
+            frames = frames[np.newaxis, ...]
+        elif len(frames.shape) == 3 and frames.shape[-1] in [1, 3, 4]:
+            # Single frame with channels
+            frames = frames[np.newaxis, ...]
+
+        if len(frames.shape) == 4:
+            if frames.shape[-1] == 1:
+                frames = frames[..., 0]
+            elif frames.shape[-1] == 4:
+                frames = frames[..., :3]
         
         logger.info(f"Processed frames shape: {frames.shape}")
         return frames
@@ -1113,10 +1186,23 @@ def prepare_for_segmentation(frame):
         logger.exception("Error preparing frame for segmentation")
         raise
 
+@functools.lru_cache(maxsize=1)
 def initialize_cellpose():
+    """Return the shared Cellpose model, loading it on first use."""
     logger.info("Initializing Cellpose")
     try:
-        model = models.Cellpose(gpu=False, model_type='cyto')
+        # Prefer a prebuilt TensorRT engine when one is configured; the
+        # contrib module only exists in TensorRT-enabled cellpose builds
+        engine_path = os.environ.get('CPSAM_ENGINE')
+        if engine_path:
+            try:
+                from cellpose.contrib.cellposetrt import CellposeModelTRT
+                model = CellposeModelTRT(gpu=True, pretrained_model=engine_path)
+                logger.info(f"Loaded Cellpose TensorRT engine: {engine_path}")
+                return model
+            except Exception as e:
+                logger.warning(f"TensorRT engine unavailable ({e}), using standard model")
+        model = models.Cellpose(gpu=torch.cuda.is_available(), model_type='cyto')
         logger.info("Cellpose initialized successfully")
         return model
     except Exception as e:
@@ -1131,28 +1217,9 @@ def get_video_preview(video_path):
         frames = process_video(video_path)
         logger.info(f"Loaded frames with shape: {frames.shape}")
         
-        # Convert frames to base64
-        encoded_frames = []
-        for i, frame in enumerate(frames):
-            # Ensure frame is uint8
-            if frame.dtype != np.uint8:
-                if frame.max() > 1:
-                    frame = (frame / frame.max() * 255).astype(np.uint8)
-                else:
-                    frame = (frame * 255).astype(np.uint8)
-            
-            # Convert to RGB if necessary
-            if len(frame.shape) == 2:
-                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
-            elif frame.shape[-1] == 4:
-                frame = frame[..., :3]
-            
-            # Encode frame
-            _, buffer = cv2.imencode('.png', frame)
-            encoded_frame = base64.b64encode(buffer).decode('utf-8')
-            encoded_frames.append(encoded_frame)
-            logger.debug(f"Encoded frame {i+1}/{len(frames)}")
-        
+        # JPEG-encode in parallel; both encoders release the GIL
+        encoded_frames = encode_preview_frames(frames)
+
         logger.info(f"Successfully encoded {len(encoded_frames)} frames")
         return encoded_frames
         
@@ -1170,12 +1237,49 @@ def handle_preflight():
     })
     return response
 
+@njit(cache=True, fastmath=True)
 def calculate_df(intensities, baseline_frames=10):
     """Calculate change in fluorescence (dF/F)."""
     baseline = np.mean(intensities[:baseline_frames])
     df = (intensities - baseline) / baseline
     return df
 
+@njit(parallel=True, cache=True, fastmath=True)
+def _df_by_group(values, starts, ends):
+    """Run calculate_df over each contiguous group slice in parallel."""
+    out = np.empty_like(values)
+    for g in prange(len(starts)):
+        out[starts[g]:ends[g]] = calculate_df(values[starts[g]:ends[g]])
+    return out
+
+@njit(parallel=True, cache=True, fastmath=True)
+def _cell_means(gray, mask, n_cells):
+    """Mean intensity per cell per frame, frames reduced in parallel."""
+    n_frames, height, width = gray.shape
+    # float32 accumulators halve the write bandwidth of the hot loop;
+    # fluorescence sums stay far below float32's integer-exact range
+    sums = np.zeros((n_frames, n_cells + 1), np.float32)
+    counts = np.zeros(n_cells + 1, np.int64)
+    for y in range(height):
+        for x in range(width):
+            counts[mask[y, x]] += 1
+    for f in prange(n_frames):
+        for y in range(height):
+            for x in range(width):
+                sums[f, mask[y, x]] += gray[f, y, x]
+    return sums[:, 1:] / counts[1:]
+
+def add_df_columns(df):
+    """Add dF/F and time columns for all cells in one vectorized pass."""
+    df = df.sort_values(['cell_id', 'frame'])
+    cell_ids = df['cell_id'].to_numpy()
+    # Groups are contiguous after the sort
+    starts = np.flatnonzero(np.r_[True, cell_ids[1:] != cell_ids[:-1]])
+    ends = np.r_[starts[1:], len(cell_ids)]
+    df['dF'] = _df_by_group(df['intensity'].to_numpy(dtype=np.float64), starts, ends)
+    df['time_seconds'] = df['frame'].to_numpy() / 30.0  # Assuming 30fps
+    return df
+
 def process_mask(mask_path):
     """Process the mask file and return the processed image with cell IDs with sequential labeling."""
     logger.info(f"Processing mask from path: {mask_path}")
@@ -1198,72 +1302,58 @@ def process_mask(mask_path):
                 mask = mask[0] if len(mask.shape) == 3 else mask[0, 0]
             logger.info(f"Converted mask shape: {mask.shape}")
 
-        unique_original_cell_ids = np.unique(mask) # Get original unique IDs
-        unique_original_cell_ids = unique_original_cell_ids[unique_original_cell_ids != 0]  # Remove background
+        # bincount finds the present IDs in one O(H*W) pass — no sort,
+        # unlike np.unique
+        pixel_counts = np.bincount(mask.ravel())
+        unique_original_cell_ids = np.nonzero(pixel_counts[1:])[0] + 1  # skip background
         logger.info(f"Found {len(unique_original_cell_ids)} unique original cell IDs: {unique_original_cell_ids}")
 
-        # Create a mapping from original IDs to sequential IDs
-        original_to_sequential_id_map = {original_id: sequential_id for sequential_id, original_id in enumerate(unique_original_cell_ids, 1)}
-
-        # Relabel the mask with sequential IDs
-        relabeled_mask = np.zeros_like(mask)
-        for original_id, sequential_id in original_to_sequential_id_map.items():
-            relabeled_mask[mask == original_id] = sequential_id
-        mask = relabeled_mask # Use the relabeled mask from now on
-
-        unique_cells = np.unique(mask) # unique_cells will now be sequential (1, 2, 3...)
-        unique_cells = unique_cells[unique_cells != 0] # remove background (should already be removed but just in case)
-        logger.info(f"Found {len(unique_cells)} unique cells after relabeling (sequential IDs): {unique_cells}")
-
+        if unique_original_cell_ids[-1] == len(unique_original_cell_ids):
+            # Already sequential (the usual case for Cellpose output):
+            # skip the relabel entirely
+            unique_cells = unique_original_cell_ids
+        else:
+            # Relabel the mask with sequential IDs via a single LUT gather
+            lut = np.zeros(int(mask.max()) + 1, dtype=mask.dtype)
+            lut[unique_original_cell_ids] = np.arange(1, len(unique_original_cell_ids) + 1)
+            mask = lut[mask] # Use the relabeled mask from now on
+            unique_cells = np.arange(1, len(unique_original_cell_ids) + 1)
+        logger.info(f"Found {len(unique_cells)} unique cells (sequential IDs): {unique_cells}")
 
-        # Create RGB image for visualization
-        mask_rgb = np.zeros((*mask.shape, 3), dtype=np.uint8)
 
         # Generate colors using HSV color space for better distinction
-        n_colors = len(unique_cells)
-        hsv_colors = np.zeros((n_colors, 3))
-        hsv_colors[:, 0] = np.linspace(0, 1, n_colors, endpoint=False)  # Hue
-        hsv_colors[:, 1] = 0.8  # Saturation
-        hsv_colors[:, 2] = 0.9  # Value
-
-        # Convert to RGB
-        colors = (cv2.cvtColor(
-            (hsv_colors.reshape(1, -1, 3) * 255).astype(np.uint8),
-            cv2.COLOR_HSV2RGB
-        )[0] * 0.7).astype(np.uint8)  # Multiply by 0.7 to make colors less bright
-
+        # (multiplied by 0.7 to make colors less bright)
+        colors = (generate_cell_colors(len(unique_cells)) * 0.7).astype(np.uint8)
         logger.info(f"Generated {len(colors)} distinct colors")
 
-        # Create mask with colors
-        for i, cell_id in enumerate(unique_cells):
-            cell_mask = mask == cell_id
-            for c in range(3):
-                mask_rgb[:, :, c][cell_mask] = colors[i, c]
+        # One palette gather colors every cell; row 0 keeps the
+        # background black
+        palette = np.vstack([np.zeros((1, 3), dtype=np.uint8), colors])
+        mask_rgb = palette[mask]
 
         # Add cell IDs as text
         text_img = np.zeros_like(mask_rgb)
         font_scale = max(0.3, min(0.7, 400 / max(mask.shape)))  # Adjust font size based on image size
         logger.info(f"Using font scale: {font_scale}")
 
-        for cell_id in unique_cells:
-            cell_mask = mask == cell_id
-            y_coords, x_coords = np.where(cell_mask)
-            if len(y_coords) > 0:
-                # Calculate weighted centroid for better text placement
-                weights = cell_mask[y_coords, x_coords].astype(float)
-                center_y = int(np.average(y_coords, weights=weights))
-                center_x = int(np.average(x_coords, weights=weights))
-
-                # Add black outline
-                for dx, dy in [(-1,-1), (-1,1), (1,-1), (1,1), (-2,0), (2,0), (0,-2), (0,2)]:
-                    cv2.putText(text_img, str(cell_id),
-                              (center_x + dx, center_y + dy),
-                              cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 2)
-
-                # Add white text
-                cv2.putText(text_img, str(cell_id),
-                          (center_x, center_y),
-                          cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), 1)
+        # All centroids come from one C pass over the label image
+        centers = ndimage.center_of_mass(np.ones_like(mask, dtype=np.uint8),
+                                         mask, unique_cells)
+        for (center_y, center_x), cell_id in zip(centers, unique_cells):
+            center_y = int(center_y)
+            center_x = int(center_x)
+
+            # A thick anti-aliased black stroke under a thin white one
+            # gives the same outline as the old 8-offset loop with two
+            # putText calls per cell instead of nine
+            cv2.putText(text_img, str(cell_id),
+                      (center_x, center_y),
+                      cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 3,
+                      lineType=cv2.LINE_AA)
+            cv2.putText(text_img, str(cell_id),
+                      (center_x, center_y),
+                      cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), 1,
+                      lineType=cv2.LINE_AA)
 
         # Blend text with mask
         mask_with_ids = cv2.addWeighted(mask_rgb, 1, text_img, 1, 0)
@@ -1276,7 +1366,7 @@ def process_mask(mask_path):
         logger.info("Mask processing completed successfully")
         return {
             'mask_image': mask_base64,
-            'cell_ids': list(original_to_sequential_id_map.values()) # Return sequential IDs
+            'cell_ids': unique_cells.tolist() # Return sequential IDs
         }
 
     except Exception as e:
@@ -36,6 +36,7 @@ function App() {
   const [file, setFile] = useState(null);
   const [maskFile, setMaskFile] = useState(null);
   const [frames, setFrames] = useState([]);
+  const [frameMime, setFrameMime] = useState('image/jpeg');
   const [currentFrame, setCurrentFrame] = useState(0);
   const [analyzing, setAnalyzing] = useState(false);
   const [results, setResults] = useState(null);
@@ -288,6 +289,7 @@ function App() {
       console.log('Video upload response:', response.data);
       setUploadedVideoPath(response.data.path);
       setFrames(response.data.frames);
+      setFrameMime(response.data.frame_mime || 'image/jpeg');
       setTotalFrames(response.data.frames.length);
       setCurrentFrame(0);
     } catch (error) {
@@ -336,7 +338,7 @@ function App() {
       });
       
       setResults(response.data);
-      setMaskPreview(response.data.mask_preview);
+      setMaskPreview(`${API_URL}${response.data.mask_preview_url}`);
       
       // Load CSV data
       if (response.data.results_path) {
@@ -461,7 +463,7 @@ function App() {
               <div className="w-full md:w-1/2">
                 <Typography variant="h6" gutterBottom className={theme === 'dark' ? 'text-gray-200' : ''}>Video</Typography>
                 <VideoDisplay 
-                  currentFrame={`data:image/png;base64,${frames[currentFrame]}`} 
+                  currentFrame={`data:${frameMime};base64,${frames[currentFrame]}`}
                   frameCount={currentFrame} 
                   brightness={brightness} 
                   contrast={contrast} 